@@ -1,8 +1,114 @@
 import math
 import numpy as np
 from scipy import linalg as spla
+from scipy import sparse as sp
+from scipy.sparse import linalg as spsla
+
+# UMFPACK is optional. If it is not installed then SuperLU is used.
+try:
+	from scikits import umfpack
+except ImportError:
+	umfpack = None
+
+# CHOLMOD is optional. If it is not installed then DC circuits are
+# factored densely when they are small and with SuperLU otherwise.
+try:
+	from sksparse import cholmod
+	from sksparse.cholmod import CholmodError
+except ImportError:
+	cholmod = None
+	CholmodError = RuntimeError
+
+# Largest number of unknown nodes for which a DC circuit is
+# factored as a dense matrix when CHOLMOD is not installed
+_DENSE_MAX = 200
+
+# Element kinds. The admittance of a triplet is its value scaled by
+# 1 for resistors, jw for capacitors, and -j/w for inductors, so the
+# stored values do not depend on the frequency.
+_RES = 0
+_CAP = 1
+_IND = 2
+
+# Prefix of the component arrays of each element kind
+_PREFIX = {_RES: '_R', _CAP: '_C', _IND: '_L'}
+
+# Quantity and element name, with its article, of each element kind used in error messages
+_NAMES = {_RES: ('resistance', 'a resistor'), _CAP: ('capacitance', 'a capacitor'), _IND: ('inductance', 'an inductor')}
 
-# TODO:  Implement AC sweep. Plotting can be done using MatPlotLib
+"""
+Stamp elements with values y between the nodes in n1 and n2 into COO
+triplets. Every element gets the same four entries, in blocks of n1.size:
+the two diagonals and the two off-diagonals. Ground is node 0, so
+entries that touch it have row or column -1 and must be masked out.
+"""
+def _stamp (n1, n2, y):
+	r1 = n1 - 1
+	r2 = n2 - 1
+
+	rows = np.concatenate ((r1, r2, r1, r2))
+	cols = np.concatenate ((r1, r2, r2, r1))
+	data = np.concatenate ((y, y, -y, -y))
+
+	return rows, cols, data
+
+"""
+Check the nodes and values of elements of the given kind
+and raise an exception if any of them is invalid
+"""
+def _checkValues (n1, n2, values, kind):
+	name, element = _NAMES[kind]
+
+	# If the value is zero or negative we cannot proceed
+	# so we raise an exception
+	bad = np.flatnonzero (values <= 0)
+	if bad.size > 0:
+		k = bad[0]
+		raise RuntimeError ("Zero or negative %s between nodes %d and %d" % (name, n1[k], n2[k]))
+
+	elif np.any (n1 == n2):
+		raise RuntimeError ("Positive and negative terminals of %s must be connected to two different nodes" % element)
+
+"""
+Factor the CSC matrix A with SuperLU in symmetric mode. Circuit matrices
+are structurally symmetric, so the column ordering permc_spec is applied
+to the rows as well and diagonal pivots are preferred, which keeps the
+fill-in of the factors low. Off-diagonal pivots are only used where a
+diagonal is exactly zero, such as the source rows of the MNA system.
+"""
+def _splu (A, permc_spec):
+	return spsla.splu (A, permc_spec = permc_spec, diag_pivot_thresh = 0.0, options = dict (SymmetricMode = True))
+
+"""
+Find the CSC sparsity pattern of a size x size matrix with COO triplets
+at rows and cols. Returns the CSC indices and indptr arrays and the
+slot in the CSC data array that every triplet is summed into.
+"""
+def _cscPattern (rows, cols, size):
+	# Sort the triplets by column and then by row. The keys are 64 bit
+	# so that they do not overflow for large circuits.
+	keys = cols.astype (np.int64) * size + rows
+	keys, slot = np.unique (keys, return_inverse = True)
+
+	indices = keys % size
+	indptr = np.searchsorted (keys // size, np.arange (size + 1))
+
+	return indices, indptr, slot
+
+"""
+Sum the values of COO triplets into their CSC slots separately for
+each element kind. Returns an array with one row per kind, so the
+CSC data at frequency w is the product of the kind scales with it.
+"""
+def _kindSums (slot, data, kinds, nslots):
+	sums = np.empty ((len (_PREFIX), nslots), dtype = np.float64)
+
+	for kind in _PREFIX:
+		sums[kind] = np.bincount (slot, weights = np.where (kinds == kind, data, 0), minlength = nslots)
+
+	return sums
+
+# TODO:  Plot the AC sweep using MatPlotLib
 
 """
 Main circuit class with support for both DC and AC circuits
@@ -14,28 +120,49 @@ class Circuit:
 	N = number of nodes in the circuit
 	Ns = number of sources in the circuit
 	w = voltage source frequency in rad/s. Currently all sources must be of the same frequency. For DC, w = 0
-	G = conductance matrix, which is built as resistors, inductors, and capacitors are added
+	_R_n1, _R_n2, _R_val = nodes and resistances of the resistors
+	_L_n1, _L_n2, _L_val = nodes and inductances of the inductors
+	_C_n1, _C_n2, _C_val = nodes and capacitances of the capacitors
+	_R_len, _L_len, _C_len = number of elements of each kind. The component arrays are preallocated and may be longer than this.
+	dtype = precision in which AC circuits are factored, either complex64 or complex128. DC circuits are always solved in float64
+	tol = largest relative residual accepted from a complex64 solve. If one step of refinement does not reach it the circuit is factored again in complex128,
+		so a tol much smaller than the complex64 precision of about 1e-7 makes complex64 slower than complex128
+	validate = whether elements are checked as they are added. If not then validateNetlist should be called after loading the circuit
 	Vin = Voltage source values
 	inNode = Nodes to which the sources are connected. Currently one node must be connected to ground.
 	vNode = Node voltages which are calculated in the calcNodeVoltages function
 	"""
-	__slots__ = 'N', 'Ns', 'w', 'G', 'Vin', 'inNode', 'vNode'
+	__slots__ = 'N', 'Ns', 'w', 'dtype', 'tol', 'validate', '_R_n1', '_R_n2', '_R_val', '_R_len', '_L_n1', '_L_n2', '_L_val', '_L_len', '_C_n1', '_C_n2', '_C_val', '_C_len', 'Vin', 'inNode', 'vNode'
 
 	"""
 	Create an instance of the Circuit class.
 	This creates a new circuit to which sources and
 	resistors can be added. As a new source or resistor
-	is added the input voltage vector and conductance
-	matrix, respectively, are updated accordingly.
+	is added the input voltage list and component
+	arrays, respectively, are updated accordingly.
+	The conductance matrix is only built in calcNodeVoltages,
+	at the size given by the largest node number seen.
 	"""
-	def __init__ (self, freq):
+	def __init__ (self, freq, dtype = np.complex128, tol = 1e-5, validate = True):
+		if np.dtype (dtype) not in (np.complex64, np.complex128):
+			raise RuntimeError ("Circuit dtype must be complex64 or complex128.")
+
 		self.N = int (0)
 		self.Ns = int (0)
 		self.w = freq
-		self.Vin = np.zeros (0, dtype = np.float64)
-		self.inNode = np.zeros (0, dtype = np.int64)
+		self.dtype = np.dtype (dtype)
+		self.tol = tol
+		self.validate = validate
+		self.Vin = []
+		self.inNode = []
 		self.vNode = np.zeros (0, dtype = np.complex128)
-		self.G = np.zeros ((0, 0), dtype = np.complex128)
+
+		# The elements are stored as one array per field for each kind
+		for prefix in _PREFIX.values ():
+			setattr (self, prefix + '_n1', np.empty (0, dtype = np.int64))
+			setattr (self, prefix + '_n2', np.empty (0, dtype = np.int64))
+			setattr (self, prefix + '_val', np.empty (0, dtype = np.float64))
+			setattr (self, prefix + '_len', int (0))
 
 	"""
 	Add a DC voltage source to the circuit.
@@ -57,103 +184,98 @@ class Circuit:
 			n2 = 0
 			value *= -1
 
-		# Increment the value of Ns, which is the number of sources
-		self.Ns += 1
+		# Only one source can set the voltage of a node
+		if n1 in self.inNode:
+			raise RuntimeError ("Node %d is already connected to a voltage source." % n1)
 
-		# Add the source to the Vin vector and update the inNode vector
-		self.Vin = np.resize (self.Vin, new_shape = self.Ns)
-		self.inNode = np.resize (self.inNode, new_shape = self.Ns)
+		# Increment the value of Ns, which is the number of sources,
+		# and update the value of N in case the source is on a new node
+		self.Ns += 1
+		self.N = max (self.N, n1)
 
-		self.Vin[self.Ns - 1] = value
-		self.inNode[self.Ns - 1] = n1
+		# Add the source to the Vin list and update the inNode list
+		self.Vin.append (value)
+		self.inNode.append (n1)
 
 	"""
-	Add a resistor to the circuit and update the conductance matrix
+	Add a resistor between nodes n1 and n2
 	"""
 	def addResistor (self, n1, n2, value):
-		# If the resistance is zero or negative we cannot proceed
-		# so we raise an exception
-		if value <= 0:
-			raise RuntimeError ("Zero or negative resistance between nodes %d and %d" % (n1, n2))
-
-		elif n1 == n2:
-			raise RuntimeError ("Positive and negative terminals of a resistor must be connected to two different nodes")
+		# A single element is checked and stored directly, which
+		# is much cheaper than going through the batch method
+		if self.validate:
+			# If the resistance is zero or negative we cannot proceed
+			# so we raise an exception
+			if value <= 0:
+				raise RuntimeError ("Zero or negative resistance between nodes %d and %d" % (n1, n2))
+
+			elif n1 == n2:
+				raise RuntimeError ("Positive and negative terminals of a resistor must be connected to two different nodes")
+
+		n = self._R_len
+		if n == self._R_val.size:
+			self._reserve ('_R', 1)
+
+		self._R_n1[n] = n1
+		self._R_n2[n] = n2
+		self._R_val[n] = value
+		self._R_len = n + 1
 
 		# Update the value of N, which is the number of nodes in the circuit
-		# If either n1 or n2 is greater than N then update its value to
-		# the maximum of n1 and n2. Then resize the conductance matrix and
-		# set the new elements to zero.
-		if (n1 > self.N) or (n2 > self.N):
-			size = np.shape (self.G)[0]
-			self.N = max (n1, n2)
-
-			self.G = np.pad (self.G, ((0, self.N - size), (0, self.N - size)), 'constant', constant_values = 0)
-
-		# Check if the new value of N is greater than the number of rows in
-		# the conductance matrix. If so then resize the conductance matrix.
-#		if self.N > np.shape (self.G)[0]:
-#			self.G = np.resize (self.G, new_shape =(self.N, self.N))
-
-		# Add the new resistor to the conductance matrix
-		# If one of the nodes is 0, meaning ground, then we
-		# only need to add it to its corresponding diagonal element.
-		if n1 == 0:
-			self.G[n2-1][n2-1] += (1 / value)
+		self.N = max (self.N, n1, n2)
 
-		elif n2 == 0:
-			self.G[n1-1][n1-1] += (1 / value)
-
-		# Otherwise we need to add it to two diagonals and
-		# two off-diagonal elements
-		else:
-			self.G[n1-1][n1-1] += (1 / value)
-			self.G[n2-1][n2-1] += (1 / value)
+	"""
+	Add resistors between the nodes in n1 and n2 with the values in values
+	"""
+	def addResistors (self, n1, n2, values):
+		n1, n2, values = self._checkElements (n1, n2, values, _RES)
 
-			self.G[n1-1][n2-1] -= (1 / value)
-			self.G[n2-1][n1-1] -= (1 / value)
+		self._addElements (n1, n2, values, _RES)
 
 	"""
 	Add an inductor between nodes n1 and n2
 	"""
 	def addInductor (self, n1, n2, value):
 		# First check if the circuit has DC or AC sources.
-		# If they are DC then we can't add the capacitor.
+		# If they are DC then we can't add the inductor.
 		if self.w == 0:
 			raise RuntimeError ("Cannot add an inductor to a DC circuit.")
 
-		# If the resistance is zero or negative we cannot proceed
-		# so we raise an exception
-		if value <= 0:
-			raise RuntimeError ("Zero or negative inductance between nodes %d and %d" % (n1, n2))
-
-		elif n1 == n2:
-			raise RuntimeError ("Positive and negative terminals of a resistor must be connected to two different nodes")
+		# A single element is checked and stored directly, which
+		# is much cheaper than going through the batch method
+		if self.validate:
+			# If the inductance is zero or negative we cannot proceed
+			# so we raise an exception
+			if value <= 0:
+				raise RuntimeError ("Zero or negative inductance between nodes %d and %d" % (n1, n2))
 
-		# Update the value of N, which is the number of nodes in the circuit
-		# If either n1 or n2 is greater than N then update its value to
-		# the maximum of n1 and n2. Then resize the conductance matrix and
-		# set the new elements to zero.
-		if (n1 > self.N) or (n2 > self.N):
-			size = np.shape (self.G)[0]
-			self.N = max (n1, n2)
+			elif n1 == n2:
+				raise RuntimeError ("Positive and negative terminals of an inductor must be connected to two different nodes")
 
-			self.G = np.pad (self.G, ((0, self.N - size), (0, self.N - size)), 'constant', constant_values = 0)
+		n = self._L_len
+		if n == self._L_val.size:
+			self._reserve ('_L', 1)
 
+		self._L_n1[n] = n1
+		self._L_n2[n] = n2
+		self._L_val[n] = value
+		self._L_len = n + 1
 
-		Z = complex (0, self.w * value)
-
-		if n1 == 0:
-			self.G[n2-1][n2-1] += (1 / Z)
+		# Update the value of N, which is the number of nodes in the circuit
+		self.N = max (self.N, n1, n2)
 
-		elif n2 == 0:
-			self.G[n1-1][n1-1] += (1 / Z)
+	"""
+	Add inductors between the nodes in n1 and n2 with the values in values
+	"""
+	def addInductors (self, n1, n2, values):
+		# First check if the circuit has DC or AC sources.
+		# If they are DC then we can't add the inductor.
+		if self.w == 0:
+			raise RuntimeError ("Cannot add an inductor to a DC circuit.")
 
-		else:
-			self.G[n1-1][n1-1] += (1 / Z)
-			self.G[n2-1][n2-1] += (1 / Z)
+		n1, n2, values = self._checkElements (n1, n2, values, _IND)
 
-			self.G[n1-1][n2-1] -= (1 / Z)
-			self.G[n2-1][n1-1] -= (1 / Z)
+		self._addElements (n1, n2, values, _IND)
 
 	"""
 	Add a capacitor between nodes 1 and 2
@@ -164,188 +286,363 @@ class Circuit:
 		if self.w == 0:
 			raise RuntimeError ("Cannot add a capacitor to a DC circuit.")
 
-		# If the resistance is zero or negative we cannot proceed
-		# so we raise an exception
-		if value <= 0:
-			raise RuntimeError ("Zero or negative resistance between nodes %d and %d" % (n1, n2))
+		# A single element is checked and stored directly, which
+		# is much cheaper than going through the batch method
+		if self.validate:
+			# If the capacitance is zero or negative we cannot proceed
+			# so we raise an exception
+			if value <= 0:
+				raise RuntimeError ("Zero or negative capacitance between nodes %d and %d" % (n1, n2))
 
-		elif n1 == n2:
-			raise RuntimeError ("Positive and negative terminals of a capacitor must be connected to two different nodes")
+			elif n1 == n2:
+				raise RuntimeError ("Positive and negative terminals of a capacitor must be connected to two different nodes")
+
+		n = self._C_len
+		if n == self._C_val.size:
+			self._reserve ('_C', 1)
+
+		self._C_n1[n] = n1
+		self._C_n2[n] = n2
+		self._C_val[n] = value
+		self._C_len = n + 1
 
 		# Update the value of N, which is the number of nodes in the circuit
-		# If either n1 or n2 is greater than N then update its value to
-		# the maximum of n1 and n2. Then resize the conductance matrix and
-		# set the new elements to zero.
-		if (n1 > self.N) or (n2 > self.N):
-			size = np.shape (self.G)[0]
-			self.N = max (n1, n2)
+		self.N = max (self.N, n1, n2)
 
-			self.G = np.pad (self.G, ((0, self.N - size), (0, self.N - size)), 'constant', constant_values = 0)
+	"""
+	Add capacitors between the nodes in n1 and n2 with the values in values
+	"""
+	def addCapacitors (self, n1, n2, values):
+		# First check if the circuit has DC or AC sources.
+		# If they are DC then we can't add the capacitor.
+		if self.w == 0:
+			raise RuntimeError ("Cannot add a capacitor to a DC circuit.")
 
+		n1, n2, values = self._checkElements (n1, n2, values, _CAP)
 
-		Z = complex (0, -1 / (self.w * value))
+		self._addElements (n1, n2, values, _CAP)
 
-		if n1 == 0:
-			self.G[n2-1][n2-1] += (1 / Z)
+	"""
+	Convert the nodes and values of new elements of the given kind to arrays.
+	The elements are only checked here if validate is set, otherwise
+	validateNetlist can check all of them at once after they are added.
+	"""
+	def _checkElements (self, n1, n2, values, kind):
+		# A scalar is treated as a single element
+		n1 = np.asarray (n1, dtype = np.int64).ravel ()
+		n2 = np.asarray (n2, dtype = np.int64).ravel ()
+		values = np.asarray (values, dtype = np.float64).ravel ()
 
-		elif n2 == 0:
-			self.G[n1-1][n1-1] += (1 / Z)
+		if not (n1.size == n2.size == values.size):
+			raise RuntimeError ("n1, n2, and values must have the same length.")
 
-		else:
-			self.G[n1-1][n1-1] += (1 / Z)
-			self.G[n2-1][n2-1] += (1 / Z)
+		if self.validate:
+			_checkValues (n1, n2, values, kind)
 
-			self.G[n1-1][n2-1] -= (1 / Z)
-			self.G[n2-1][n1-1] -= (1 / Z)
+		return n1, n2, values
 
 	"""
-	Calculate the node voltages by solving the linear system
-	of equations created by the conductance matrix and the input voltage vector
+	Check every element in the circuit. This is meant for circuits created
+	with validate = False, where the elements are not checked as they are added.
 	"""
-	def calcNodeVoltages (self):
-		nodes = self.N
-		self.vNode = np.resize (self.vNode, new_shape = (nodes, 1))
+	def validateNetlist (self):
+		for kind, prefix in _PREFIX.items ():
+			n = getattr (self, prefix + '_len')
 
-		self.vNode[:] = 0
+			_checkValues (getattr (self, prefix + '_n1')[:n], getattr (self, prefix + '_n2')[:n], getattr (self, prefix + '_val')[:n], kind)
 
-		# Copy the values in Vin to vVector
-		for n in range (0, self.Ns):
-			i = self.inNode[n] - 1
+	"""
+	Add elements of the given kind with values between the nodes in n1 and n2
+	"""
+	def _addElements (self, n1, n2, values, kind):
+		# Update the value of N, which is the number of nodes in the circuit
+		if n1.size > 0:
+			self.N = int (max (self.N, n1.max (), n2.max ()))
 
-			self.vNode[i] = self.Vin[n]
+		prefix = _PREFIX[kind]
+		n = getattr (self, prefix + '_len')
 
-			self.G[i][:] = 0
-			self.G[i][i] = 1
+		self._reserve (prefix, n1.size)
 
-		# Solve the system of equations and
-		# check for exceptions
-		try:
-			self.vNode = spla.solve (self.G, self.vNode)
+		getattr (self, prefix + '_n1')[n:n + n1.size] = n1
+		getattr (self, prefix + '_n2')[n:n + n1.size] = n2
+		getattr (self, prefix + '_val')[n:n + n1.size] = values
 
-		# Check if the matrix is singular
-		except LinAlgError:
-			raise ("Failed to calculate node voltages. Conductance matrix is singular.")
+		setattr (self, prefix + '_len', n + n1.size)
+
+	"""
+	Make sure there is room for k more elements in the component arrays
+	with the given prefix. The capacity is doubled when it runs out so
+	that adding elements is amortised O(1).
+	"""
+	def _reserve (self, prefix, k):
+		n = getattr (self, prefix + '_len')
+		size = getattr (self, prefix + '_val').size
+
+		if n + k <= size:
+			return
+
+		cap = max (2 * size, n + k, 16)
+
+		for field in ('_n1', '_n2', '_val'):
+			old = getattr (self, prefix + field)
+			new = np.empty (cap, dtype = old.dtype)
+			new[:n] = old[:n]
+			setattr (self, prefix + field, new)
 
 	"""
-	Perform a frequency sweep of the circuit and plot the frequency
-	response. Plotting is done using MatPlotLib and output has
-	units of dB.
+	Stamp every element into COO triplets of the conductance matrix.
+	The values are 1/R, C, and 1/L, which are scaled by the frequency
+	when the matrix is built. Returns the rows, columns, values, and
+	element kinds of the triplets.
+	"""
+	def _stampAll (self):
+		blocks = []
+
+		for kind, prefix in _PREFIX.items ():
+			n = getattr (self, prefix + '_len')
+			n1 = getattr (self, prefix + '_n1')[:n]
+			n2 = getattr (self, prefix + '_n2')[:n]
+			val = getattr (self, prefix + '_val')[:n]
 
-	def freqSweep (wLow, wHigh, n):
-		# Check that wLow is a power of 10
-		# If it is not then make it the largest
-		# power of 10 less than wLow
-		l = math.floor (math.log10 (wLow))
-		if 10**l != wLow:
-			wLow = 10**l
+			y = val if kind == _CAP else 1.0 / val
 
-		# Now do the same thing for wHigh
-		l = math.floor (math.log10 (wHigh))
-		if 10**l != wHigh:
-			wHigh = 10**l
+			# Every element adds the same four entries to the conductance
+			# matrix. Ground is node 0, so its row and column are -1, and
+			# the entries that touch it are masked out.
+			rows, cols, data = _stamp (n1, n2, y)
 
-		# Determine the number of decades covered by the
-		# interval [wLow, wHigh]
-		nDecades = math.log10 (wHigh / wLow)
+			m = (rows >= 0) & (cols >= 0)
 
-		# Starting frequency for the sweep
-		w = wLow
+			blocks.append ((rows[m], cols[m], data[m], np.full (np.count_nonzero (m), kind, dtype = np.int8)))
 
-		for i in range (0, nDecades):
-			# Determine the sample points using the size of
-			# the current range and the specified number
-			# of samples per decade
-			dp = (10 / n) * wLow
+		rows, cols, data, kinds = zip (*blocks)
 
-			# Starting frequency for the current decade
-			p0 = wLow
+		return np.concatenate (rows), np.concatenate (cols), np.concatenate (data), np.concatenate (kinds)
 
-			for j in range (0, n):
-				w = p0 + dp * j
 	"""
-	Print the result vector
+	Calculate the node voltages by solving the linear system
+	of equations created by the conductance matrix and the input voltage vector
 	"""
-	def printNodeVoltages (self):
-		i = 1
-		for v in self.vNode:
-			# If the real part of the voltage is zero then the voltage is purely imaginary
-			if v.real == 0:
-				# If the imaginary part is also zero then the voltage at the node is zero
-				if v.imag == 0:
-					print ("V%d = 0<0" % i)
-
-				# If the imaginary part is negative then there is a -90 (270) degree phase shift
-				elif v.imag < 0:
-					print ("V%d = %f<-90" % (i, -1 * v.imag))
-
-				# Otherwise the imaginary part is positive
-				else:
-					print ("V%d = %f<90" % (i, v.imag))
+	def calcNodeVoltages (self):
+		# Inductors and capacitors cannot be added to a DC circuit, so a DC
+		# conductance matrix is real and symmetric positive definite
+		if self.w == 0:
+			self.vNode = self._solveResistive ()
+
+		else:
+			self.vNode = self._solveAC (np.array ([self.w]))[0]
+
+	"""
+	Build a new conductance matrix of a DC circuit in CSC format. A DC
+	circuit only contains resistors, so the matrix is real. The matrix is
+	assembled from the component arrays on every call, so solving the
+	circuit never modifies stored state.
+	"""
+	def _assembleG (self):
+		rows, cols, data, kinds = self._stampAll ()
+
+		# Duplicate entries are summed when converting from COO to CSC format
+		return sp.coo_matrix ((data, (rows, cols)), shape = (self.N, self.N)).tocsc ()
 
+	"""
+	Solve a DC circuit using a Cholesky factorization.
+	The source node voltages are known, so they are moved to the right hand
+	side, which leaves a symmetric positive definite system for the other nodes.
+	"""
+	def _solveResistive (self):
+		nodes = self.N
+
+		src = np.asarray (self.inNode, dtype = np.int64) - 1
+		vin = np.asarray (self.Vin, dtype = np.float64)
 
-			# If the real part of the voltage is negative we can print it normally
-			elif v.real < 0:
-				# If the imaginary part is zero then we don't need to calculate the phase shift
-				if v.imag == 0:
-					print ("V%d = %f<0" % (i, v.real))
+		G = self._assembleG ()
 
-				# If the imaginary part is negative we can print both normally
-				elif v.imag < 0:
-					# Calculate the magnitude
-					mag = math.sqrt (v.real**2 + v.imag**2)
+		v = np.zeros (nodes, dtype = np.float64)
+		v[src] = vin
 
-					# Calculate the phase shift in radians
-					angle = math.pi + math.atan (v.imag / v.real)
+		free = np.ones (nodes, dtype = bool)
+		free[src] = False
+
+		# If every node is connected to a source there is nothing to solve
+		if not np.any (free):
+			return v
+
+		# v is zero at the free nodes, so G @ v only contains
+		# the contributions of the source nodes. Subtracting from 0.0
+		# instead of negating keeps zeros positive, so nodes with no path
+		# to a source print with a phase of 0 rather than 180 degrees.
+		Gf = G[free]
+		Gff = Gf[:, free]
+		b = 0.0 - Gf @ v
+
+		try:
+			if cholmod is not None:
+				v[free] = cholmod.cholesky (Gff) (b)
 
-					# Convert the phase shift from radians to degrees
-					angle *= (180 / math.pi)
+			elif Gff.shape[0] <= _DENSE_MAX:
+				v[free] = spla.cho_solve (spla.cho_factor (Gff.toarray ()), b)
 
-					print ("V%d = %f<%f" % (i, mag, angle))
+			else:
+				v[free] = _splu (Gff, 'MMD_AT_PLUS_A').solve (b)
+
+		# Check if the matrix is singular
+		except (RuntimeError, spla.LinAlgError, CholmodError):
+			raise RuntimeError ("Failed to calculate node voltages. Conductance matrix is singular.")
+
+		return v
+
+	"""
+	Solve an AC circuit at each of the frequencies in ws using
+	modified nodal analysis. Returns the node voltages with one
+	row per frequency.
+	"""
+	def _solveAC (self, ws):
+		nodes = self.N
+		size = nodes + self.Ns
+
+		# An empty circuit has no node voltages
+		if size == 0:
+			return np.zeros ((len (ws), 0), dtype = np.complex128)
+
+		src = np.asarray (self.inNode, dtype = np.int64) - 1
+		cur = nodes + np.arange (self.Ns)
+
+		# Use modified nodal analysis for the sources. Each source adds the
+		# current through it as an unknown, connected to its node in the
+		# source column, and forces the node voltage equal to the source
+		# voltage in the source row.
+		rows, cols, data, kinds = self._stampAll ()
+
+		rows = np.concatenate ((rows, src, cur))
+		cols = np.concatenate ((cols, cur, src))
+		data = np.concatenate ((data, np.ones (2 * self.Ns)))
+		kinds = np.concatenate ((kinds, np.full (2 * self.Ns, _RES, dtype = np.int8)))
+
+		b = np.zeros (size, dtype = np.complex128)
+		b[nodes:] = self.Vin
+
+		# The sparsity pattern is the same at every frequency, so duplicate
+		# triplets are summed into their CSC slots once for each kind
+		indices, indptr, slot = _cscPattern (rows, cols, size)
+		sums = _kindSums (slot, data, kinds, indices.size)
+		perm = None
+
+		v = np.zeros ((len (ws), nodes), dtype = np.complex128)
+		scale = np.empty (3, dtype = np.complex128)
+
+		# UMFPACK only works in double precision
+		useUmfpack = (umfpack is not None) and (self.dtype == np.complex128)
+
+		for i, w in enumerate (ws):
+			scale[_RES] = 1
+			scale[_CAP] = 1j * w
+			scale[_IND] = -1j / w
+
+			# G(w) = G0 + jwC - j/w L, where G0, C, and L are the summed
+			# values of each kind
+			K = sp.csc_matrix ((scale @ sums, indices, indptr), shape = (size, size))
+
+			# Factor the system matrix and solve the system of
+			# equations. UMFPACK is used if it is installed and the circuit
+			# is solved in double precision, otherwise SuperLU is used.
+			# The system matrix is structurally symmetric, so the ordering
+			# found at the first frequency is applied to both the rows and
+			# columns of the pattern and reused for the others.
+			try:
+				if useUmfpack:
+					x = umfpack.splu (K).solve (b)
+
+				elif perm is None:
+					lu = _splu (K.astype (self.dtype), 'MMD_AT_PLUS_A')
+					x = self._refine (K, lu, b)
+
+					# The reordered pattern is only needed if there
+					# are more frequencies to solve
+					if len (ws) > 1:
+						# SuperLU moves row and column i of K to perm[i]
+						perm = lu.perm_c
+						inv = np.empty_like (perm)
+						inv[perm] = np.arange (size)
+						indices, indptr, slot = _cscPattern (perm[rows], perm[cols], size)
+						sums = _kindSums (slot, data, kinds, indices.size)
 
-				# Otherwise the imaginary part is positive
 				else:
-					# Calculate the magnitude
-					mag = math.sqrt (v.real**2 + v.imag**2)
+					lu = _splu (K.astype (self.dtype), 'NATURAL')
+					x = self._refine (K, lu, b[inv])[perm]
 
-					# Calculate the phase shift in radians
-					angle = math.pi - math.atan (v.imag / v.real)
+			# Check if the matrix is singular
+			except RuntimeError:
+				raise RuntimeError ("Failed to calculate node voltages. Conductance matrix is singular.")
 
-					# Convert the phase shift from radians to degrees
-					angle *= (180 / math.pi)
+			# UMFPACK only warns when the matrix is singular instead of raising
+			# an exception, so also check that the solution is finite
+			if not np.all (np.isfinite (x)):
+				raise RuntimeError ("Failed to calculate node voltages. Conductance matrix is singular.")
 
-					print ("V%d = %f<%f" % (i, mag, angle))
+			# The node voltages are the first N unknowns. The rest
+			# are the currents through the sources.
+			v[i] = x[:nodes]
 
-			# Otherwise the real part of the voltage is positive
-			else:
-				# If the imaginary part is zero then there is no phase shift
-				if v.imag == 0:
-					print ("V%d =  %f<0" % (i, v.real))
+		return v
+
+	"""
+	Solve K x = b using the factorization lu of K, which may be in single
+	precision. The residual is checked in double precision and, if it is
+	larger than tol relative to b, one step of iterative refinement is done.
+	If that is not enough K is factored again in double precision.
+	"""
+	def _refine (self, K, lu, b):
+		x = lu.solve (b.astype (self.dtype)).astype (np.complex128)
 
-				# If the imaginary part is negative
-				elif v.imag < 0:
-					# Calculate the magnitude
-					mag = math.sqrt (v.real**2 + v.imag**2)
+		if self.dtype == np.complex128:
+			return x
 
-					# Calculate the phase shift in radians
-					angle = math.atan (v.imag / v.real)
+		bNorm = np.linalg.norm (b)
 
-					# Convert the phase shift from radians to degrees
-					angle *= (180 / math.pi)
+		r = b - K @ x
+		if np.linalg.norm (r) <= self.tol * bNorm:
+			return x
 
-					print ("V%d = %f<%f" % (i, mag, angle))
+		x += lu.solve (r.astype (self.dtype))
 
-				# Otherwise both the real and imaginary parts of the voltage are positive
-				else:
-					# Calculate the magnitude
-					mag = math.sqrt (v.real**2 + v.imag**2)
+		r = b - K @ x
+		if np.linalg.norm (r) <= self.tol * bNorm:
+			return x
 
-					# Calculate the phase shift in radians
-					angle = math.atan (v.imag / v.real)
+		return _splu (K, 'MMD_AT_PLUS_A').solve (b)
 
-					# Convert the phase shift from radians to degrees
-					angle *= (180 / math.pi)
+	"""
+	Perform a frequency sweep of the circuit from wLow to wHigh
+	with n samples per decade. Returns the frequencies in rad/s and
+	the node voltages with one row per frequency. The circuit's own
+	frequency and vNode are left unchanged.
+	"""
+	def freqSweep (self, wLow, wHigh, n):
+		if (wLow <= 0) or (wHigh <= wLow):
+			raise RuntimeError ("Frequency sweep must satisfy 0 < wLow < wHigh.")
 
-					print ("V%d = %f<%f" % (i, mag, angle))
+		elif n < 1:
+			raise RuntimeError ("Frequency sweep must have at least one sample per decade.")
 
-			i += 1
+		# Make wLow the largest power of 10 less than or equal to wLow
+		# and wHigh the smallest power of 10 greater than or equal to wHigh
+		lLow = math.floor (math.log10 (wLow))
+		lHigh = math.ceil (math.log10 (wHigh))
+
+		# Sample each of the decades covered by the interval n times
+		ws = np.logspace (lLow, lHigh, (lHigh - lLow) * n + 1)
+
+		return ws, self._solveAC (ws)
+
+	"""
+	Print the result vector
+	"""
+	def printNodeVoltages (self):
+		# Calculate the magnitude and the phase shift in degrees of every
+		# node voltage. np.angle handles all four quadrants.
+		mags = np.abs (self.vNode)
+		angles = np.degrees (np.angle (self.vNode))
 
+		for i, (mag, angle) in enumerate (zip (mags, angles), 1):
+			print (f"V{i} = {mag:f}<{angle:f}")